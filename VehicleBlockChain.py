@@ -3,7 +3,11 @@ import json
 import datetime
 import os
 import logging
-from typing import List, Dict, Any, Optional
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import count
+from operator import attrgetter
+from typing import List, Dict, Any, Optional, Tuple
 
 # logging configuration
 logging.basicConfig(
@@ -16,6 +20,38 @@ logging.basicConfig(
 )
 logger = logging.getLogger("VehicleBlockchain")
 
+# most nonces tried by each worker before the pool checks for a hit
+_NONCE_BATCH = 10000
+
+
+def _scan_nonces(prefix: bytes, start: int, step: int, attempts: Optional[int], bound: bytes) -> Optional[Tuple[int, bytes]]:
+    """
+    tries nonces start, start + step, ... until the digest is not above bound
+
+    Args:
+        prefix (bytes): serialized block without the nonce
+        start (int): first nonce
+        step (int): distance between two nonces
+        attempts (Optional[int]): max number of nonces, None for no limit
+        bound (bytes): highest accepted digest, 32 bytes big-endian
+
+    Returns:
+        Optional[Tuple[int, bytes]]: (nonce, digest) of the first hit, None if not found
+    """
+    # only the nonce changes while mining: hash the rest of the block once
+    # and copy that sha256 state for every attempt
+    # (bound methods are looked up once, outside the hot loop)
+    copy = hashlib.sha256(prefix).copy
+    nonces = count(start, step) if attempts is None else range(start, start + step * attempts, step)
+    for nonce in nonces:
+        h = copy()
+        h.update(b"%d" % nonce)
+        digest = h.digest()
+        # same length bytes compare like big-endian numbers: a single memcmp
+        if digest <= bound:
+            return nonce, digest
+    return None
+
 class Block:
     """
     A block in the blockchain
@@ -25,7 +61,7 @@ class Block:
         timestamp (str): time of block creation in ISO format.
         data (dict): Data in the block.
         previous_hash (str): Hash of previous block.
-        hash (str): Hash of this block.
+        hash (str): Hash of this block, hex of the 32 bytes kept in _hash_raw.
         nonce (int): proof of work.
     """
     
@@ -35,29 +71,99 @@ class Block:
         self.data = data
         self.previous_hash = previous_hash
         self.nonce = 0
-        self.hash = self.hash_block()
+        self._hash_raw = self.hash_block()
+        # set only when the stored hash is not a hex digest
+        self._hash_text: Optional[str] = None
     
-    def hash_block(self) -> str:
-        # claculating hash sha256
+    @property
+    def hash(self) -> str:
+        # hex only when it is needed for logging, linking and saving
+        if self._hash_text is not None:
+            return self._hash_text
+        return self._hash_raw.hex()
+    
+    @hash.setter
+    def hash(self, value: str) -> None:
         try:
-            block_string = f"{self.index}{self.timestamp}{json.dumps(self.data, sort_keys=True)}{self.previous_hash}{self.nonce}"
-            return hashlib.sha256(block_string.encode()).hexdigest()
+            raw = bytes.fromhex(value)
+        except (TypeError, ValueError):
+            raw = None
+        if raw is not None and raw.hex() == value:
+            self._hash_raw = raw
+            self._hash_text = None
+        else:
+            # e.g. an edited data file: keep the value as it is, an empty digest
+            # never matches hash_block so is_chain_valid rejects the block
+            self._hash_raw = b""
+            self._hash_text = value
+    
+    def _prefix(self) -> bytes:
+        # everything hashed except the nonce: serialized once per mining run,
+        # not cached so that is_chain_valid sees later changes to data
+        return f"{self.index}{self.timestamp}{json.dumps(self.data, sort_keys=True)}{self.previous_hash}".encode()
+    
+    def hash_block(self) -> bytes:
+        # claculating hash sha256, raw 32 bytes
+        try:
+            h = hashlib.sha256(self._prefix())
+            h.update(b"%d" % self.nonce)
+            return h.digest()
         except Exception as e:
-            logger.error(f"Errore durante il calcolo dell'hash: {e}")
+            logger.error("Errore durante il calcolo dell'hash: %s", e)
             raise
     
-    def mine_block(self, difficulty: int) -> None:
+    def mine_block(self, difficulty: int, workers: int = 1) -> None:
         """
         proof of work
         
         Args:
             difficulty (int): Number of 0 at the beginning of hash
+            workers (int): processes searching the nonce in parallel
+        """
+        # `difficulty` leading hex zeros <=> at least 4 * difficulty leading zero
+        # bits <=> the digest is not above the bound
+        bound = ((1 << (256 - 4 * difficulty)) - 1).to_bytes(32, "big")
+        prefix = self._prefix()
+        if workers > 1:
+            self.nonce, digest = self._mine_parallel(prefix, bound, workers, difficulty)
+        else:
+            self.nonce, digest = _scan_nonces(prefix, self.nonce, 1, None, bound)
+        self._hash_raw = digest
+        self._hash_text = None
+        # self.hash hex-encodes the digest, skip it when INFO is off
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Blocco minato: %s", self.hash)
+
+    def _mine_parallel(self, prefix: bytes, bound: bytes, workers: int, difficulty: int) -> Tuple[int, bytes]:
+        """
+        splits the nonce search between processes
+
+        worker i tries nonces base + i, base + i + workers, ... so the lowest
+        hit of a round is the same nonce a single process would find
+
+        Args:
+            prefix (bytes): serialized block without the nonce
+            bound (bytes): highest accepted digest
+            workers (int): number of processes
+            difficulty (int): Number of 0 at the beginning of hash
+
+        Returns:
+            Tuple[int, bytes]: nonce and digest
         """
-        target = "0" * difficulty
-        while self.hash[:difficulty] != target:
-            self.nonce += 1
-            self.hash = self.hash_block()
-        logger.info(f"Blocco minato: {self.hash}")
+        # a hit is expected after about 16 ** difficulty attempts: bigger rounds
+        # only keep every worker busy long after one of them found it
+        batch = min(_NONCE_BATCH, 16 ** difficulty)
+        base = self.nonce
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            while True:
+                futures = [
+                    pool.submit(_scan_nonces, prefix, base + i, workers, batch, bound)
+                    for i in range(workers)
+                ]
+                hits = [hit for hit in (f.result() for f in futures) if hit is not None]
+                if hits:
+                    return min(hits)
+                base += workers * batch
 
 class VehicleBlockchain:
     """
@@ -67,12 +173,24 @@ class VehicleBlockchain:
         chain (List[Block): chain
         difficulty (int): Difficulty of proof of work
         data_file (str): file path
+        workers (int): processes used to mine a block
     """
     
-    def __init__(self, difficulty: int = 2, data_file: str = "blockchain_data.json"):
+    def __init__(self, difficulty: int = 2, data_file: str = "blockchain_data.json", workers: int = 1):
         self.chain: List[Block] = []
         self.difficulty = difficulty
         self.data_file = data_file
+        self.workers = workers
+        # False once an unreadable data file could not be moved aside:
+        # the chain then lives only in memory and the file is left untouched
+        self._persist = True
+        # vehicle_id -> blocks of that vehicle, kept in sync with chain
+        self._by_vehicle: Dict[str, List[Block]] = defaultdict(list)
+        # sha256 of the raw hashes of the chain, updated at every append;
+        # None while the blocks are not known to be valid
+        self._chain_digest: Optional["hashlib._Hash"] = hashlib.sha256()
+        # sha256 of the data file as written here, saved in <data_file>.digest
+        self._file_digest: "hashlib._Hash" = hashlib.sha256()
         
         # create the chain o add the block
         if os.path.exists(data_file):
@@ -88,8 +206,10 @@ class VehicleBlockchain:
             data={"message": "Blocco Genesi"},
             previous_hash="0"
         )
-        genesis_block.mine_block(self.difficulty)
+        genesis_block.mine_block(self.difficulty, self.workers)
         self.chain.append(genesis_block)
+        if self._chain_digest is not None:
+            self._chain_digest.update(genesis_block._hash_raw)
         logger.info("Blocco genesi creato")
         self.save_chain()
     
@@ -119,14 +239,17 @@ class VehicleBlockchain:
                 previous_hash=previous_block.hash
             )
             
-            new_block.mine_block(self.difficulty)
+            new_block.mine_block(self.difficulty, self.workers)
             self.chain.append(new_block)
-            logger.info(f"New Block Added {vehicle_id}")
+            self._by_vehicle[vehicle_id].append(new_block)
+            if self._chain_digest is not None:
+                self._chain_digest.update(new_block._hash_raw)
+            logger.info("New Block Added %s", vehicle_id)
             
-            self.save_chain()
+            self._append_block(new_block)
             return True
         except Exception as e:
-            logger.error(f"Loading Error: {e}")
+            logger.error("Loading Error: %s", e)
             return False
     
     def _validate_data(self, vehicle_id: str, sensor_data: dict) -> None:
@@ -162,59 +285,206 @@ class VehicleBlockchain:
         data_string = f"{vehicle_id}{json.dumps(sensor_data, sort_keys=True)}"
         return hashlib.sha256(data_string.encode()).hexdigest()
     
-    def is_chain_valid(self) -> bool:
+    def is_chain_valid(self, quick: bool = False) -> bool:
         """
         verify blockchain
         
+        Args:
+            quick (bool): skip recomputing the hash of every block if the
+                stored hashes are still the ones mined here, loaded from a
+                file that matches its saved digest, or last fully verified.
+                Changes made in memory to block data are only detected by
+                the full check.
+        
         Returns:
             bool: True if blockchain is valid
         """
-        for i in range(1, len(self.chain)):
-            current = self.chain[i]
-            previous = self.chain[i - 1]
-            
-            # verify current hash
-            if current.hash != current.hash_block():
-                logger.warning(f"Hash invalido nel blocco {i}")
-                return False
-            
-            # Verify previous hash
-            if current.previous_hash != previous.hash:
-                logger.warning(f"Collegamento rotto tra blocchi {i-1} e {i}")
-                return False
+        # Verify previous hash
+        i = self._broken_link()
+        if i is not None:
+            logger.warning("Collegamento rotto tra blocchi %d e %d", i - 1, i)
+            self._chain_digest = None
+            return False
         
+        # quick: one sha256 over all the hashes instead of one per block,
+        # the full check runs only if it does not match the running digest
+        if quick and self._chain_digest is not None:
+            if self._hashes_digest().digest() == self._chain_digest.digest():
+                logger.info("Blockchain verified: Valid")
+                return True
+        
+        # verify current hash
+        i = self._invalid_hash()
+        if i is not None:
+            logger.warning("Hash invalido nel blocco %d", i)
+            self._chain_digest = None
+            return False
+        
+        # verified block by block: quick checks and saves can trust it again
+        self._chain_digest = self._hashes_digest()
         logger.info("Blockchain verified: Valid")
         return True
     
+    def _broken_link(self) -> Optional[int]:
+        # the links of the whole chain are compared as two lists, the python
+        # loop only runs to find the broken one
+        hashes = list(map(attrgetter("hash"), self.chain))
+        previous_hashes = list(map(attrgetter("previous_hash"), self.chain))
+        if previous_hashes[1:] == hashes[:-1]:
+            return None
+        return next(i for i in range(1, len(self.chain)) if previous_hashes[i] != hashes[i - 1])
+    
+    def _invalid_hash(self) -> Optional[int]:
+        # first block whose hash does not match its content
+        for i in range(1, len(self.chain)):
+            block = self.chain[i]
+            if block._hash_raw != block.hash_block():
+                return i
+        return None
+    
+    def _hashes_digest(self) -> "hashlib._Hash":
+        # sha256 of the raw hashes of the whole chain
+        return hashlib.sha256(b"".join(map(attrgetter("_hash_raw"), self.chain)))
+    
+    def _block_record(self, block: Block) -> str:
+        # one line of the data file
+        return json.dumps({
+            "index": block.index,
+            "timestamp": block.timestamp,
+            "data": block.data,
+            "previous_hash": block.previous_hash,
+            "nonce": block.nonce,
+            "hash": block.hash
+        }) + "\n"
+    
     def save_chain(self) -> None:
-        """save the blockchain in a file."""
+        """save the whole blockchain in a file, one block per line."""
+        if not self._persist:
+            return
+        # the blocks in memory may have been changed since they were checked:
+        # only a chain that still verifies gets a digest file
+        if self._chain_digest is not None and (self._broken_link() is not None or self._invalid_hash() is not None):
+            self._chain_digest = None
         try:
-            data = []
-            for block in self.chain:
-                block_data = {
-                    "index": block.index,
-                    "timestamp": block.timestamp,
-                    "data": block.data,
-                    "previous_hash": block.previous_hash,
-                    "nonce": block.nonce,
-                    "hash": block.hash
-                }
-                data.append(block_data)
+            # written aside and then swapped in: a crash never leaves half a chain
+            tmp_file = f"{self.data_file}.tmp"
+            file_digest = hashlib.sha256()
+            with open(tmp_file, 'wb') as f:
+                for block in self.chain:
+                    record = self._block_record(block).encode()
+                    f.write(record)
+                    file_digest.update(record)
+            os.replace(tmp_file, self.data_file)
+            self._file_digest = file_digest
+            self._save_digest()
             
-            with open(self.data_file, 'w') as f:
-                json.dump(data, f, indent=4)
+            logger.info("Blockchain saved in %s", self.data_file)
+        except Exception as e:
+            logger.error("Saving error: %s", e)
+    
+    def _append_block(self, block: Block) -> None:
+        """append a single block to the file without rewriting the chain."""
+        if not self._persist:
+            return
+        try:
+            record = self._block_record(block).encode()
+            with open(self.data_file, 'ab') as f:
+                f.write(record)
+            self._file_digest.update(record)
+            self._save_digest()
             
-            logger.info(f"Blockchain saved in {self.data_file}")
+            logger.info("Block %d saved in %s", block.index, self.data_file)
         except Exception as e:
-            logger.error(f"Saving error: {e}")
+            logger.error("Saving error: %s", e)
+    
+    def _save_digest(self) -> None:
+        """save the digest of the data file, only for a chain that can be trusted."""
+        if self._chain_digest is None:
+            return
+        try:
+            tmp_file = f"{self.data_file}.digest.tmp"
+            with open(tmp_file, 'w') as f:
+                f.write(self._file_digest.hexdigest())
+            os.replace(tmp_file, f"{self.data_file}.digest")
+        except OSError as e:
+            logger.error("Saving error: %s", e)
+    
+    def _saved_digest(self) -> Optional[str]:
+        # digest saved with the data file, None if there is none
+        try:
+            with open(f"{self.data_file}.digest", 'r') as f:
+                return f.read().strip()
+        except OSError:
+            return None
+    
+    def _backup_file(self) -> str:
+        # new name next to the data file for bytes that cannot be loaded
+        return f"{self.data_file}.corrupt-{datetime.datetime.now():%Y%m%d%H%M%S%f}"
+    
+    def _repair_tail(self, tail: bytes, size: int) -> Optional[dict]:
+        """
+        handles a last line with no newline, left by an interrupted append
+        
+        Args:
+            tail (bytes): the last line of the file
+            size (int): size of the file in bytes
+            
+        Returns:
+            Optional[dict]: the block data, None if the line was incomplete and dropped
+        """
+        try:
+            block_data = json.loads(tail)
+        except ValueError:
+            block_data = None
+        
+        try:
+            if block_data is None:
+                # keep a copy of the dropped line, then cut it from the file
+                backup = self._backup_file()
+                with open(backup, 'xb') as f:
+                    f.write(tail)
+                with open(self.data_file, 'r+b') as f:
+                    f.truncate(size - len(tail))
+                logger.warning("Incomplete last block of %s moved to %s", self.data_file, backup)
+            else:
+                # only the newline is missing: add it so the next append gets its own line
+                with open(self.data_file, 'ab') as f:
+                    f.write(b"\n")
+        except OSError as e:
+            # the rest of the chain is fine: load it, but leave the file as it
+            # is rather than appending after a broken last line
+            logger.error("Repair error: %s, new blocks will not be saved", e)
+            self._persist = False
+        return block_data
     
     def load_chain(self) -> None:
         """load blockchain from file."""
         try:
-            with open(self.data_file, 'r') as f:
-                data = json.load(f)
+            with open(self.data_file, 'rb') as f:
+                content = f.read()
+            
+            # files saved before the switch to one block per line hold a json list
+            legacy = content.lstrip().startswith(b"[")
+            if legacy:
+                data = json.loads(content)
+            else:
+                lines = content.split(b"\n")
+                tail = lines.pop()
+                data = [json.loads(line) for line in lines if line.strip()]
+                if tail.strip():
+                    block_data = self._repair_tail(tail, len(content))
+                    if block_data is None:
+                        content = content[:-len(tail)]
+                    else:
+                        data.append(block_data)
+                        content += b"\n"
+            if not data:
+                raise ValueError("no blocks in file")
             
-            self.chain = []
+            chain = []
+            by_vehicle = defaultdict(list)
+            chain_digest = hashlib.sha256()
+            file_digest = hashlib.sha256(content)
             for block_data in data:
                 block = Block(
                     index=block_data["index"],
@@ -224,11 +494,36 @@ class VehicleBlockchain:
                 )
                 block.nonce = block_data["nonce"]
                 block.hash = block_data["hash"]
-                self.chain.append(block)
+                chain.append(block)
+                chain_digest.update(block._hash_raw)
+                # only string ids, like _validate_data accepts: an edited file
+                # could hold anything, even values that cannot be dict keys
+                vehicle_id = block.data.get("vehicle_id") if isinstance(block.data, dict) else None
+                if block.index > 0 and isinstance(vehicle_id, str):
+                    by_vehicle[vehicle_id].append(block)
+            self.chain = chain
+            self._by_vehicle = by_vehicle
+            # a file changed since it was saved here (or never saved with a
+            # digest) makes the quick check fall back to the full one
+            trusted = not legacy and self._saved_digest() == file_digest.hexdigest()
+            self._chain_digest = chain_digest if trusted else None
+            self._file_digest = file_digest
             
-            logger.info(f"Blockchain loaded from {self.data_file}")
+            logger.info("Blockchain loaded from %s", self.data_file)
+            if legacy:
+                self.save_chain()
         except Exception as e:
-            logger.error(f"Loading error: {e}")
+            logger.error("Loading error: %s", e)
+            # keep the unreadable file for inspection, never write over it
+            backup = self._backup_file()
+            try:
+                if os.path.exists(backup):
+                    raise FileExistsError(backup)
+                os.replace(self.data_file, backup)
+                logger.error("Unreadable blockchain moved to %s", backup)
+            except OSError as move_error:
+                logger.error("Moving error: %s, the new chain will not be saved", move_error)
+                self._persist = False
             self.create_genesis_block()
     
     def get_block_by_vehicle_id(self, vehicle_id: str) -> List[Block]:
@@ -241,8 +536,7 @@ class VehicleBlockchain:
         Returns:
             List[Block]: blocklist of the vehicle
         """
-        return [block for block in self.chain 
-                if block.index > 0 and block.data.get("vehicle_id") == vehicle_id]
+        return list(self._by_vehicle.get(vehicle_id, []))
 
 
 if __name__ == "__main__":
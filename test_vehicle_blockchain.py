@@ -0,0 +1,164 @@
+import glob
+import json
+import logging
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import VehicleBlockChain
+from VehicleBlockChain import Block, VehicleBlockchain
+
+logging.getLogger("VehicleBlockchain").setLevel(logging.CRITICAL)
+
+
+class ChainFileTestCase(unittest.TestCase):
+    """runs every test in its own folder with a small chain on disk"""
+
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+        self.data_file = "chain.json"
+        bc = VehicleBlockchain(difficulty=1, data_file=self.data_file)
+        for i in range(3):
+            self.assertTrue(bc.add_data("CAR-%d" % (i % 2), {"km": i}))
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def read(self) -> bytes:
+        with open(self.data_file, 'rb') as f:
+            return f.read()
+
+    def write(self, content: bytes) -> None:
+        with open(self.data_file, 'wb') as f:
+            f.write(content)
+
+    def backups(self) -> list:
+        return sorted(glob.glob(f"{self.data_file}.corrupt-*"))
+
+
+class LoadRecoveryTest(ChainFileTestCase):
+
+    def test_torn_append_is_dropped_and_kept_aside(self):
+        saved = self.read()
+        self.write(saved + b'{"index": 4, "timest')
+
+        bc = VehicleBlockchain(difficulty=1, data_file=self.data_file)
+
+        self.assertEqual(len(bc.chain), 4)
+        self.assertTrue(bc.is_chain_valid())
+        self.assertEqual(self.read(), saved)
+        [backup] = self.backups()
+        with open(backup, 'rb') as f:
+            self.assertEqual(f.read(), b'{"index": 4, "timest')
+
+    def test_missing_newline_keeps_the_last_block(self):
+        self.write(self.read().rstrip(b"\n"))
+
+        bc = VehicleBlockchain(difficulty=1, data_file=self.data_file)
+        self.assertEqual(len(bc.chain), 4)
+        self.assertTrue(bc.add_data("CAR-9", {"km": 9}))
+
+        bc = VehicleBlockchain(difficulty=1, data_file=self.data_file)
+        self.assertEqual(len(bc.chain), 5)
+        self.assertTrue(bc.is_chain_valid())
+        self.assertEqual(self.backups(), [])
+
+    def test_unreadable_file_is_moved_aside(self):
+        lines = self.read().split(b"\n")
+        lines[1] = b"not json"
+        broken = b"\n".join(lines)
+        self.write(broken)
+
+        bc = VehicleBlockchain(difficulty=1, data_file=self.data_file)
+
+        self.assertEqual(len(bc.chain), 1)
+        [backup] = self.backups()
+        with open(backup, 'rb') as f:
+            self.assertEqual(f.read(), broken)
+
+    def test_unreadable_file_is_left_untouched_if_it_cannot_be_moved(self):
+        self.write(b"not json\n")
+
+        with mock.patch.object(VehicleBlockChain.os, "replace", side_effect=OSError("read-only")):
+            bc = VehicleBlockchain(difficulty=1, data_file=self.data_file)
+        self.assertEqual(len(bc.chain), 1)
+        self.assertTrue(bc.add_data("CAR-9", {"km": 9}))
+
+        self.assertEqual(self.read(), b"not json\n")
+        self.assertEqual(self.backups(), [])
+
+
+class QuickCheckTrustTest(ChainFileTestCase):
+
+    def load(self) -> VehicleBlockchain:
+        return VehicleBlockchain(difficulty=1, data_file=self.data_file)
+
+    def edit_record(self, index: int, km: int) -> None:
+        lines = self.read().decode().splitlines()
+        record = json.loads(lines[index])
+        record["data"]["sensor_data"]["km"] = km
+        lines[index] = json.dumps(record)
+        self.write(("\n".join(lines) + "\n").encode())
+
+    def test_clean_reload_skips_rehashing(self):
+        bc = self.load()
+        with mock.patch.object(Block, "hash_block", side_effect=AssertionError("rehashed")):
+            self.assertTrue(bc.is_chain_valid(quick=True))
+
+    def test_reload_after_edit_on_disk(self):
+        self.edit_record(2, 99)
+
+        bc = self.load()
+
+        self.assertFalse(bc.is_chain_valid(quick=True))
+        self.assertFalse(bc.is_chain_valid())
+
+    def test_failed_full_check_drops_trust(self):
+        bc = self.load()
+        bc.chain[1].data["sensor_data"]["km"] = 99
+
+        self.assertFalse(bc.is_chain_valid())
+        self.assertFalse(bc.is_chain_valid(quick=True))
+
+    def test_reload_after_save_following_edit_in_memory(self):
+        bc = self.load()
+        bc.chain[1].data["sensor_data"]["km"] = 99
+        bc.save_chain()
+
+        bc = self.load()
+
+        self.assertFalse(bc.is_chain_valid(quick=True))
+        self.assertFalse(bc.is_chain_valid())
+
+    def test_legacy_file_is_not_trusted(self):
+        records = [json.loads(line) for line in self.read().splitlines()]
+        records[2]["data"]["sensor_data"]["km"] = 99
+        self.write(json.dumps(records, indent=4).encode())
+        os.remove(f"{self.data_file}.digest")
+
+        bc = self.load()
+
+        self.assertEqual(len(bc.chain), 4)
+        self.assertFalse(bc.is_chain_valid(quick=True))
+        bc = self.load()
+        self.assertFalse(bc.is_chain_valid(quick=True))
+
+    def test_validation_does_not_write_the_digest(self):
+        os.remove(f"{self.data_file}.digest")
+
+        bc = self.load()
+
+        self.assertTrue(bc.is_chain_valid())
+        self.assertFalse(os.path.exists(f"{self.data_file}.digest"))
+        self.assertTrue(bc.add_data("CAR-9", {"km": 9}))
+        bc = self.load()
+        with mock.patch.object(Block, "hash_block", side_effect=AssertionError("rehashed")):
+            self.assertTrue(bc.is_chain_valid(quick=True))
+
+
+if __name__ == "__main__":
+    unittest.main()